@@ -7,7 +7,7 @@
 """
 DESCRIPTION:
     This sample demonstrates how to use agent operations with the
-    Model Context Protocol (MCP) tool from the Azure Agents service using a synchronous client.
+    Model Context Protocol (MCP) tool from the Azure Agents service using an asynchronous client.
     To learn more about Model Context Protocol, visit https://modelcontextprotocol.io/
 
 USAGE:
@@ -15,7 +15,7 @@ USAGE:
 
     Before running the sample:
 
-    pip install azure-ai-projects azure-ai-agents azure-identity --pre
+    pip install azure-ai-projects azure-ai-agents azure-identity aiohttp --pre
 
     Set these environment variables with your own values:
     1) PROJECT_ENDPOINT - The Azure AI Project endpoint, as found in the Overview
@@ -26,10 +26,14 @@ USAGE:
     4) MCP_SERVER_LABEL - A label for your MCP server.
 """
 
-import os, time
+import os
+import asyncio
+import hashlib
 from dotenv import load_dotenv
-from azure.ai.projects import AIProjectClient
-from azure.identity import DefaultAzureCredential
+from azure.ai.projects.aio import AIProjectClient
+from azure.core.exceptions import ResourceNotFoundError
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.identity.aio import DefaultAzureCredential
 from azure.ai.agents.models import McpTool, RequiredMcpToolCall, SubmitToolApprovalAction, ToolApproval
 
 # Load environment variables from .env file
@@ -48,129 +52,210 @@ missing_vars = [var for var in required_vars if not os.environ.get(var)]
 if missing_vars:
     raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
 
-project_client = AIProjectClient(
-    endpoint=azure_project_endpoint,
-    credential=DefaultAzureCredential(),
-)
-
-# [START create_agent_with_mcp_tool]
-# Initialize agent MCP tool with authentication headers
-mcp_tool = McpTool(
-    server_label=mcp_server_label,
-    server_url=mcp_server_url
-)
-
-# Configure authentication headers immediately after tool creation
-if mcp_server_token:
-    mcp_tool.update_headers("Authorization", f"Bearer {mcp_server_token}")
-else:
-    print("Warning: No MCP_SERVER_TOKEN found in environment variables")
-
-# Create agent with MCP tool and process agent run
-with project_client:
-    agents_client = project_client.agents
-
-    # Create a new agent.
-    # NOTE: To reuse existing agent, fetch it with get_agent(agent_id)
-    agent = agents_client.create_agent(
-        model=azure_model_deployment_name,
-        name="HomeAssistantMCPAgent",
-        instructions=f"""You are a helpful agent that can use MCP tools to assist users. 
+# Polling backoff: start fast so short runs return quickly, cap so long runs don't hammer the service
+INITIAL_POLL_DELAY = 0.25
+MAX_POLL_DELAY = 2.0
+
+AGENT_INSTRUCTIONS = f"""You are a helpful agent that can use MCP tools to assist users.
         You have access to a Home Assistant MCP server at {mcp_server_url} with label '{mcp_server_label}'.
         Use the available MCP tools to answer questions about home automation, sensor data, and device control.
-        When making MCP calls, ensure you use the proper authentication headers that have been configured.""",
-        tools=mcp_tool.definitions,
-    )
-    # [END create_agent_with_mcp_tool]
+        When making MCP calls, ensure you use the proper authentication headers that have been configured."""
+
+AGENT_NAME = "HomeAssistantMCPAgent"
+
+# File where the agent ID is cached between runs, keyed by a hash of the agent
+# configuration so instruction or server changes invalidate the cached agent.
+# The filename carries the agent name so this script and mainchat.py, which
+# configure different agents, don't overwrite each other's entry.
+AGENT_ID_FILE = f".agent_id.{AGENT_NAME}"
+
+
+def _agent_config_hash() -> str:
+    key = "\n".join((azure_model_deployment_name, AGENT_INSTRUCTIONS, mcp_server_url, mcp_server_label))
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
 
-    print(f"Created agent, ID: {agent.id}")
-    print(f"MCP Server: {mcp_tool.server_label} at {mcp_tool.server_url}")
+def _load_cached_agent_id(config_hash: str):
+    """Return a cached agent ID (AGENT_ID env or .agent_id file) if it matches the current config"""
+    agent_id = os.environ.get("AGENT_ID")
+    if agent_id:
+        return agent_id
+    try:
+        with open(AGENT_ID_FILE, encoding="utf-8") as f:
+            cached_hash, _, cached_id = f.read().strip().partition(":")
+    except OSError:
+        return None
+    return cached_id if cached_id and cached_hash == config_hash else None
 
-    # Create thread for communication
-    thread = agents_client.threads.create()
-    print(f"Created thread, ID: {thread.id}")
 
-    # Create message to thread
-    message = agents_client.messages.create(
-        thread_id=thread.id,
-        role="user",
-        content="Qué temperatura hace en el salón?",
+def _store_cached_agent_id(config_hash: str, agent_id: str):
+    try:
+        with open(AGENT_ID_FILE, "w", encoding="utf-8") as f:
+            f.write(f"{config_hash}:{agent_id}\n")
+    except OSError as e:
+        print(f"Warning: could not cache agent ID: {e}")
+
+
+async def main():
+    # Explicit transport so the polling-heavy run loop reuses one keep-alive
+    # connection pool instead of paying per-call DNS/TLS setup, with pipeline
+    # retries for transient 429/503s
+    transport = AioHttpTransport(connection_timeout=10, read_timeout=60)
+    credential = DefaultAzureCredential()
+    project_client = AIProjectClient(
+        endpoint=azure_project_endpoint,
+        credential=credential,
+        transport=transport,
+        retry_total=5,
+        retry_backoff_factor=0.5,
+    )
+
+    # [START create_agent_with_mcp_tool]
+    # Initialize agent MCP tool with authentication headers
+    mcp_tool = McpTool(
+        server_label=mcp_server_label,
+        server_url=mcp_server_url
     )
-    print(f"Created message, ID: {message.id}")
-
-    # [START handle_tool_approvals]
-    # Create and process agent run in thread with MCP tools
-    # Headers were already configured during tool creation
-    mcp_tool.set_approval_mode("never")  # Disable approval requirement for smoother operation
-    run = agents_client.runs.create(thread_id=thread.id, agent_id=agent.id, tool_resources=mcp_tool.resources)
-    print(f"Created run, ID: {run.id}")
-
-    while run.status in ["queued", "in_progress", "requires_action"]:
-        time.sleep(1)
-        run = agents_client.runs.get(thread_id=thread.id, run_id=run.id)
-
-        if run.status == "requires_action" and isinstance(run.required_action, SubmitToolApprovalAction):
-            tool_calls = run.required_action.submit_tool_approval.tool_calls
-            if not tool_calls:
-                print("No tool calls provided - cancelling run")
-                agents_client.runs.cancel(thread_id=thread.id, run_id=run.id)
-                break
-
-            tool_approvals = []
-            for tool_call in tool_calls:
-                if isinstance(tool_call, RequiredMcpToolCall):
-                    try:
-                        print(f"Approving tool call: {tool_call}")
-                        tool_approvals.append(
-                            ToolApproval(
-                                tool_call_id=tool_call.id,
-                                approve=True,
-                                headers=mcp_tool.headers,
-                            )
-                        )
-                    except Exception as e:
-                        print(f"Error approving tool_call {tool_call.id}: {e}")
-
-            print(f"tool_approvals: {tool_approvals}")
-            if tool_approvals:
-                agents_client.runs.submit_tool_outputs(
-                    thread_id=thread.id, run_id=run.id, tool_approvals=tool_approvals
-                )
-
-        print(f"Current run status: {run.status}")
+
+    # Configure authentication headers immediately after tool creation
+    if mcp_server_token:
+        mcp_tool.update_headers("Authorization", f"Bearer {mcp_server_token}")
+    else:
+        print("Warning: No MCP_SERVER_TOKEN found in environment variables")
+
+    # Frozen snapshot of the headers for tool approvals; mcp_tool.headers may
+    # be rebuilt on each access, so share one copy instead of one per approval
+    approval_headers = dict(mcp_tool.headers)
+
+    # Create agent with MCP tool and process agent run; the aio credential
+    # owns its own HTTP sessions, so it must be closed alongside the client
+    async with credential, project_client:
+        agents_client = project_client.agents
+
+        # Reuse the agent across runs: fetch it by its cached ID when the
+        # configuration is unchanged, create (and cache) it otherwise
+        config_hash = _agent_config_hash()
+        cached_agent_id = _load_cached_agent_id(config_hash)
+        agent = None
+        if cached_agent_id:
+            try:
+                agent = await agents_client.get_agent(cached_agent_id)
+                print(f"Reusing agent, ID: {agent.id}")
+            except ResourceNotFoundError:
+                # Cached agent was deleted server-side; create a fresh one
+                print(f"Cached agent {cached_agent_id} no longer exists - creating a new one")
+        if agent is None:
+            agent = await agents_client.create_agent(
+                model=azure_model_deployment_name,
+                name=AGENT_NAME,
+                instructions=AGENT_INSTRUCTIONS,
+                tools=mcp_tool.definitions,
+            )
+            _store_cached_agent_id(config_hash, agent.id)
+            print(f"Created agent, ID: {agent.id}")
+        # [END create_agent_with_mcp_tool]
+
+        print(f"MCP Server: {mcp_tool.server_label} at {mcp_tool.server_url}")
+
+        # Create thread for communication
+        thread = await agents_client.threads.create()
+        print(f"Created thread, ID: {thread.id}")
+
+        # Create message to thread
+        message = await agents_client.messages.create(
+            thread_id=thread.id,
+            role="user",
+            content="Qué temperatura hace en el salón?",
+        )
+        print(f"Created message, ID: {message.id}")
+
+        # [START handle_tool_approvals]
+        # Create and process agent run in thread with MCP tools
+        # Headers were already configured during tool creation
+        mcp_tool.set_approval_mode("never")  # Disable approval requirement for smoother operation
+
+        run = await agents_client.runs.create(thread_id=thread.id, agent_id=agent.id, tool_resources=mcp_tool.resources)
+        print(f"Created run, ID: {run.id}")
+
+        # Poll with exponential backoff instead of a fixed 1s sleep: the wait is pure
+        # network IO, so yielding to the event loop lets one process drive many agents.
+        # NOTE: runs.create_and_process in this SDK version is the same client-side
+        # poll at a fixed 1s interval and cannot handle SubmitToolApprovalAction,
+        # so the hand-rolled loop stays.
+        delay = INITIAL_POLL_DELAY
+        while run.status in {"queued", "in_progress", "requires_action"}:
+            if run.status == "requires_action" and isinstance(run.required_action, SubmitToolApprovalAction):
+                tool_calls = run.required_action.submit_tool_approval.tool_calls
+                if not tool_calls:
+                    print("No tool calls provided - cancelling run")
+                    await agents_client.runs.cancel(thread_id=thread.id, run_id=run.id)
+                    break
+
+                # Approve the whole batch in one submit; the isinstance filter
+                # already excludes anything ToolApproval could not accept
+                tool_approvals = [
+                    ToolApproval(
+                        tool_call_id=tool_call.id,
+                        approve=True,
+                        headers=approval_headers,
+                    )
+                    for tool_call in tool_calls
+                    if isinstance(tool_call, RequiredMcpToolCall)
+                ]
+
+                print(f"tool_approvals: {tool_approvals}")
+                if tool_approvals:
+                    await agents_client.runs.submit_tool_outputs(
+                        thread_id=thread.id, run_id=run.id, tool_approvals=tool_approvals
+                    )
+                    # Re-fetch immediately after submitting: if the agent
+                    # queues another approval batch it should not sit
+                    # behind the next backoff sleep. With nothing submitted
+                    # the run is still requires_action, so fall through to
+                    # the sleep instead of spinning on runs.get.
+                    run = await agents_client.runs.get(thread_id=thread.id, run_id=run.id)
+                    continue
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 1.5, MAX_POLL_DELAY)
+            run = await agents_client.runs.get(thread_id=thread.id, run_id=run.id)
+
+            print(f"Current run status: {run.status}")
         # [END handle_tool_approvals]
 
-    print(f"Run completed with status: {run.status}")
-    if run.status == "failed":
-        print(f"Run failed: {run.last_error}")
+        print(f"Run completed with status: {run.status}")
+        if run.status == "failed":
+            print(f"Run failed: {run.last_error}")
+
+        # Display run steps and tool calls
+        run_steps = agents_client.run_steps.list(thread_id=thread.id, run_id=run.id)
 
-    # Display run steps and tool calls
-    run_steps = agents_client.run_steps.list(thread_id=thread.id, run_id=run.id)
+        # Loop through each step
+        async for step in run_steps:
+            print(f"Step {step['id']} status: {step['status']}")
 
-    # Loop through each step
-    for step in run_steps:
-        print(f"Step {step['id']} status: {step['status']}")
+            # Check if there are tool calls in the step details
+            step_details = step.get("step_details", {})
+            tool_calls = step_details.get("tool_calls", [])
 
-        # Check if there are tool calls in the step details
-        step_details = step.get("step_details", {})
-        tool_calls = step_details.get("tool_calls", [])
+            if tool_calls:
+                print("  MCP Tool calls:")
+                for call in tool_calls:
+                    print(f"    Tool Call ID: {call.get('id')}")
+                    print(f"    Type: {call.get('type')}")
 
-        if tool_calls:
-            print("  MCP Tool calls:")
-            for call in tool_calls:
-                print(f"    Tool Call ID: {call.get('id')}")
-                print(f"    Type: {call.get('type')}")
+            print()  # add an extra newline between steps
 
-        print()  # add an extra newline between steps
+        # Fetch and log all messages
+        messages = agents_client.messages.list(thread_id=thread.id)
+        print("\nConversation:")
+        print("-" * 50)
+        async for msg in messages:
+            if msg.text_messages:
+                last_text = msg.text_messages[-1]
+                print(f"{msg.role.upper()}: {last_text.text.value}")
+                print("-" * 50)
 
-    # Fetch and log all messages
-    messages = agents_client.messages.list(thread_id=thread.id)
-    print("\nConversation:")
-    print("-" * 50)
-    for msg in messages:
-        if msg.text_messages:
-            last_text = msg.text_messages[-1]
-            print(f"{msg.role.upper()}: {last_text.text.value}")
-            print("-" * 50)
 
-    
\ No newline at end of file
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -8,12 +8,12 @@
 DESCRIPTION:
     This file implements a dynamic chat interface using Chainlit
     to interact with an Azure AI Agent Service agent configured with MCP.
-    
+
 USAGE:
     chainlit run mainchat.py
 
     Before running the application:
-    
+
     pip install azure-ai-projects azure-ai-agents azure-identity chainlit --pre
 
     Set these environment variables with your own values:
@@ -25,167 +25,270 @@ USAGE:
 """
 
 import os
-import time
 import asyncio
-from typing import Dict, Optional
+import hashlib
+import types
 import chainlit as cl
 from dotenv import load_dotenv
-from azure.ai.projects import AIProjectClient
-from azure.identity import DefaultAzureCredential
+from azure.ai.projects.aio import AIProjectClient
+from azure.core.exceptions import ResourceNotFoundError
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.identity.aio import DefaultAzureCredential
 from azure.ai.agents.models import McpTool, RequiredMcpToolCall, SubmitToolApprovalAction, ToolApproval
 
 # Load environment variables from .env file
 load_dotenv()
 
-class AzureAIAgentHandler:
-    def __init__(self):
-        self.project_client: Optional[AIProjectClient] = None
-        self.agents_client = None
-        self.agent = None
-        self.thread = None
-        self.mcp_tool = None
-        
-    async def initialize(self):
-        """Initialize Azure AI client and create agent with MCP"""
-        try:
-            # Get MCP server configuration from environment variables
-            mcp_server_url = os.environ.get("MCP_SERVER_URL")
-            mcp_server_label = os.environ.get("MCP_SERVER_LABEL")
-            mcp_server_token = os.environ.get("MCP_SERVER_TOKEN")
-            azure_project_endpoint = os.environ.get("PROJECT_ENDPOINT")
-            azure_model_deployment_name = os.environ.get("MODEL_DEPLOYMENT_NAME")
-
-            # Verify that required environment variables are set
-            required_vars = ["PROJECT_ENDPOINT", "MODEL_DEPLOYMENT_NAME", "MCP_SERVER_URL", "MCP_SERVER_LABEL"]
-            missing_vars = [var for var in required_vars if not os.environ.get(var)]
-            if missing_vars:
-                raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
-
-            # Initialize project client
-            self.project_client = AIProjectClient(
-                endpoint=azure_project_endpoint,
-                credential=DefaultAzureCredential(),
-            )
-
-            # Initialize agent MCP tool with authentication headers
-            self.mcp_tool = McpTool(
-                server_label=mcp_server_label,
-                server_url=mcp_server_url
-            )
-
-            # Configure authentication headers immediately after tool creation
-            if mcp_server_token:
-                self.mcp_tool.update_headers("Authorization", f"Bearer {mcp_server_token}")
-            else:
-                print("Warning: No MCP_SERVER_TOKEN found in environment variables")
-
-            # Create agents client
-            self.agents_client = self.project_client.agents
-
-            # Create a new agent
-            self.agent = self.agents_client.create_agent(
-                model=azure_model_deployment_name,
-                name="HomeAssistantMCPChatAgent",
-                instructions=f"""You are a helpful assistant that can use MCP tools to help users. 
-                You have access to a Home Assistant MCP server at {mcp_server_url} with label '{mcp_server_label}'.
-                
-                When using Home Assistant MCP tools like HassTurnOn, HassTurnOff, etc:
-                - Only use the required parameters: 'name' and 'area' 
-                - Do NOT include optional parameters like 'floor', 'domain', or 'device_class' unless explicitly needed
-                - Keep the tool calls simple and minimal
-                
-                Example for turning on a device:
-                - Use only: {{"name": "Device Name", "area": "Area Name"}}
-                
-                Add emoji reactions to your messages for a more interactive experience! 🤖🔌🏠, specially when you describe devices, areas or status of house devices.
-                """,
-                tools=self.mcp_tool.definitions,
-            )
-
-            # Create thread for communication
-            self.thread = self.agents_client.threads.create()
-            
-            # Configure approval mode
-            self.mcp_tool.set_approval_mode("never")  # Disable approval requirement for smoother operation
-            
-            return True
-            
-        except Exception as e:
-            print(f"Error initializing agent: {e}")
-            return False
-
-    async def send_message(self, content: str) -> str:
-        """Send a message to the agent and return the response"""
-        try:
-            # Create message in thread
-            message = self.agents_client.messages.create(
-                thread_id=self.thread.id,
-                role="user",
-                content=content,
-            )
-
-            # Create and process agent run in thread with MCP tools
-            run = self.agents_client.runs.create(
-                thread_id=self.thread.id, 
-                agent_id=self.agent.id, 
-                tool_resources=self.mcp_tool.resources
-            )
-
-            # Wait for run completion
-            while run.status in ["queued", "in_progress", "requires_action"]:
-                await asyncio.sleep(1)
-                run = self.agents_client.runs.get(thread_id=self.thread.id, run_id=run.id)
-
-                if run.status == "requires_action" and isinstance(run.required_action, SubmitToolApprovalAction):
-                    tool_calls = run.required_action.submit_tool_approval.tool_calls
-                    if not tool_calls:
-                        print("No tool calls provided - cancelling run")
-                        self.agents_client.runs.cancel(thread_id=self.thread.id, run_id=run.id)
-                        break
-
-                    tool_approvals = []
-                    for tool_call in tool_calls:
-                        if isinstance(tool_call, RequiredMcpToolCall):
-                            try:
-                                tool_approvals.append(
-                                    ToolApproval(
-                                        tool_call_id=tool_call.id,
-                                        approve=True,
-                                        headers=self.mcp_tool.headers,
-                                    )
-                                )
-                            except Exception as e:
-                                print(f"Error approving tool_call {tool_call.id}: {e}")
-
-                    if tool_approvals:
-                        self.agents_client.runs.submit_tool_outputs(
-                            thread_id=self.thread.id, 
-                            run_id=run.id, 
-                            tool_approvals=tool_approvals
-                        )
-
-            if run.status == "failed":
-                return f"Error: Run failed - {run.last_error}"
-
-            # Get all messages and return the latest assistant response
-            messages = self.agents_client.messages.list(thread_id=self.thread.id)
-            for msg in messages:
-                if msg.role == "assistant" and msg.text_messages:
-                    last_text = msg.text_messages[-1]
-                    return last_text.text.value
-            
-            return "No response received from agent."
-            
-        except Exception as e:
-            return f"Error processing message: {str(e)}"
-
-    def cleanup(self):
-        """Clean up resources"""
-        if self.project_client:
-            self.project_client.close()
-
-# Global instance of the agent handler
-agent_handler = AzureAIAgentHandler()
+# Configuration is parsed once at import and kept frozen in a namespace; a
+# missing required variable fails fast here instead of on the first message
+Config = types.SimpleNamespace(
+    project_endpoint=os.environ.get("PROJECT_ENDPOINT"),
+    model=os.environ.get("MODEL_DEPLOYMENT_NAME"),
+    mcp_url=os.environ.get("MCP_SERVER_URL"),
+    mcp_label=os.environ.get("MCP_SERVER_LABEL"),
+    mcp_token=os.environ.get("MCP_SERVER_TOKEN"),
+)
+
+# Verify that required environment variables are set
+required_vars = ["PROJECT_ENDPOINT", "MODEL_DEPLOYMENT_NAME", "MCP_SERVER_URL", "MCP_SERVER_LABEL"]
+missing_vars = [var for var in required_vars if not os.environ.get(var)]
+if missing_vars:
+    raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
+
+# The client (and its HTTP connection pool) is the expensive object: build it once
+# per process and share it across all chat sessions. Per-user state lives in
+# cl.user_session instead.
+CREDENTIAL = DefaultAzureCredential()
+
+# Explicit transport so every operation (create_agent, messages, the runs.get
+# poll loop, ...) reuses one keep-alive connection pool for the process
+# lifetime, and transient 429/503s are retried in the pipeline instead of
+# surfacing as run failures
+TRANSPORT = AioHttpTransport(connection_timeout=10, read_timeout=60)
+PROJECT_CLIENT = AIProjectClient(
+    endpoint=Config.project_endpoint,
+    credential=CREDENTIAL,
+    transport=TRANSPORT,
+    retry_total=5,
+    retry_backoff_factor=0.5,
+)
+AGENTS_CLIENT = PROJECT_CLIENT.agents
+
+# Initialize agent MCP tool with authentication headers
+MCP_TOOL = McpTool(
+    server_label=Config.mcp_label,
+    server_url=Config.mcp_url
+)
+
+# Configure authentication headers immediately after tool creation
+if Config.mcp_token:
+    MCP_TOOL.update_headers("Authorization", f"Bearer {Config.mcp_token}")
+else:
+    print("Warning: No MCP_SERVER_TOKEN found in environment variables")
+
+MCP_TOOL.set_approval_mode("never")  # Disable approval requirement for smoother operation
+
+# Polling backoff: start fast so short runs return quickly, cap so long runs don't hammer the service
+INITIAL_POLL_DELAY = 0.25
+MAX_POLL_DELAY = 2.0
+
+# Frozen snapshot of the headers for tool approvals; MCP_TOOL.headers may be
+# rebuilt on each access, so share one copy instead of one per approval
+APPROVAL_HEADERS = dict(MCP_TOOL.headers)
+
+AGENT_INSTRUCTIONS = f"""You are a helpful assistant that can use MCP tools to help users.
+    You have access to a Home Assistant MCP server at {Config.mcp_url} with label '{Config.mcp_label}'.
+
+    When using Home Assistant MCP tools like HassTurnOn, HassTurnOff, etc:
+    - Only use the required parameters: 'name' and 'area'
+    - Do NOT include optional parameters like 'floor', 'domain', or 'device_class' unless explicitly needed
+    - Keep the tool calls simple and minimal
+
+    Example for turning on a device:
+    - Use only: {{"name": "Device Name", "area": "Area Name"}}
+
+    Add emoji reactions to your messages for a more interactive experience! 🤖🔌🏠, specially when you describe devices, areas or status of house devices.
+    """
+
+AGENT_NAME = "HomeAssistantMCPChatAgent"
+
+# File where the agent ID is cached between runs, keyed by a hash of the agent
+# configuration so instruction or server changes invalidate the cached agent.
+# The filename carries the agent name so this app and main.py, which configure
+# different agents, don't overwrite each other's entry.
+AGENT_ID_FILE = f".agent_id.{AGENT_NAME}"
+
+
+def _agent_config_hash() -> str:
+    key = "\n".join((Config.model, AGENT_INSTRUCTIONS, Config.mcp_url, Config.mcp_label))
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def _load_cached_agent_id(config_hash: str):
+    """Return a cached agent ID (AGENT_ID env or .agent_id file) if it matches the current config"""
+    agent_id = os.environ.get("AGENT_ID")
+    if agent_id:
+        return agent_id
+    try:
+        with open(AGENT_ID_FILE, encoding="utf-8") as f:
+            cached_hash, _, cached_id = f.read().strip().partition(":")
+    except OSError:
+        return None
+    return cached_id if cached_id and cached_hash == config_hash else None
+
+
+def _store_cached_agent_id(config_hash: str, agent_id: str):
+    try:
+        with open(AGENT_ID_FILE, "w", encoding="utf-8") as f:
+            f.write(f"{config_hash}:{agent_id}\n")
+    except OSError as e:
+        print(f"Warning: could not cache agent ID: {e}")
+
+
+# Shared agent, resolved lazily on the first chat start (the aio client cannot
+# be awaited at import time); every later session reuses it
+AGENT = None
+_agent_lock = asyncio.Lock()
+
+
+async def _ensure_agent():
+    """Fetch or create the shared agent once; reuse the cached ID across restarts"""
+    global AGENT
+    if AGENT is None:
+        async with _agent_lock:
+            if AGENT is None:
+                config_hash = _agent_config_hash()
+                cached_agent_id = _load_cached_agent_id(config_hash)
+                if cached_agent_id:
+                    try:
+                        AGENT = await AGENTS_CLIENT.get_agent(cached_agent_id)
+                    except ResourceNotFoundError:
+                        # Cached agent was deleted server-side; create a fresh one
+                        print(f"Cached agent {cached_agent_id} no longer exists - creating a new one")
+                if AGENT is None:
+                    AGENT = await AGENTS_CLIENT.create_agent(
+                        model=Config.model,
+                        name=AGENT_NAME,
+                        instructions=AGENT_INSTRUCTIONS,
+                        tools=MCP_TOOL.definitions,
+                    )
+                    _store_cached_agent_id(config_hash, AGENT.id)
+    return AGENT
+
+@cl.on_app_startup
+async def warm_credential():
+    """Resolve the DefaultAzureCredential probe chain before the first user message.
+
+    The first get_token call walks the credential sources (environment, managed
+    identity, az CLI, ...) and can take hundreds of ms; doing it here caches the
+    token on the credential so the first message doesn't pay that cost. The
+    scope matches the azure-ai-projects/azure-ai-agents credential_scopes so
+    the cached token is the one the client pipelines actually reuse.
+    """
+    try:
+        await CREDENTIAL.get_token("https://ai.azure.com/.default")
+    except Exception as e:
+        print(f"Warning: credential pre-warm failed: {e}")
+
+
+@cl.on_app_shutdown
+async def close_client():
+    """Close the shared client when the app shuts down, not per chat session"""
+    await PROJECT_CLIENT.close()
+    await CREDENTIAL.close()
+
+
+async def _poll_run(thread_id: str):
+    """Create a run and drive it to a terminal state with client-side polling.
+
+    Polls with exponential backoff (250ms up to a 2s cap) and handles MCP
+    tool approvals while the run is in requires_action.
+    """
+    run = await AGENTS_CLIENT.runs.create(
+        thread_id=thread_id,
+        agent_id=AGENT.id,
+        tool_resources=MCP_TOOL.resources
+    )
+
+    # Wait for run completion
+    delay = INITIAL_POLL_DELAY
+    while run.status in ["queued", "in_progress", "requires_action"]:
+        if run.status == "requires_action" and isinstance(run.required_action, SubmitToolApprovalAction):
+            tool_calls = run.required_action.submit_tool_approval.tool_calls
+            if not tool_calls:
+                print("No tool calls provided - cancelling run")
+                await AGENTS_CLIENT.runs.cancel(thread_id=thread_id, run_id=run.id)
+                break
+
+            # Approve the whole batch in one submit; the isinstance filter
+            # already excludes anything ToolApproval could not accept
+            tool_approvals = [
+                ToolApproval(
+                    tool_call_id=tool_call.id,
+                    approve=True,
+                    headers=APPROVAL_HEADERS,
+                )
+                for tool_call in tool_calls
+                if isinstance(tool_call, RequiredMcpToolCall)
+            ]
+
+            if tool_approvals:
+                await AGENTS_CLIENT.runs.submit_tool_outputs(
+                    thread_id=thread_id,
+                    run_id=run.id,
+                    tool_approvals=tool_approvals
+                )
+                # Re-fetch immediately after submitting: if the agent queues
+                # another approval batch it should not sit behind the next
+                # sleep tick. With nothing submitted the run is still
+                # requires_action, so fall through to the sleep instead of
+                # spinning on runs.get.
+                run = await AGENTS_CLIENT.runs.get(thread_id=thread_id, run_id=run.id)
+                continue
+
+        await asyncio.sleep(delay)
+        delay = min(delay * 1.5, MAX_POLL_DELAY)
+        run = await AGENTS_CLIENT.runs.get(thread_id=thread_id, run_id=run.id)
+
+    return run
+
+
+async def send_message(content: str) -> str:
+    """Send a message to the agent on this session's thread and return the response"""
+    try:
+        thread_id = cl.user_session.get("thread_id")
+
+        # Create message in thread
+        message = await AGENTS_CLIENT.messages.create(
+            thread_id=thread_id,
+            role="user",
+            content=content,
+        )
+
+        # Drive the run with the hand-rolled backoff loop: in this SDK version
+        # runs.create_and_process is the same client-side poll at a fixed 1s
+        # interval and cannot handle SubmitToolApprovalAction, so it offers
+        # neither fewer round-trips nor approval support.
+        run = await _poll_run(thread_id)
+
+        if run.status == "failed":
+            return f"Error: Run failed - {run.last_error}"
+
+        # Fetch only the newest message instead of re-downloading the whole
+        # thread history; after a completed run it is the assistant's reply.
+        # Stop after the first item: the pager would otherwise keep walking
+        # the thread one message per request.
+        messages = AGENTS_CLIENT.messages.list(thread_id=thread_id, order="desc", limit=1)
+        async for msg in messages:
+            if msg.role == "assistant" and msg.text_messages:
+                return msg.text_messages[-1].text.value
+            break
+
+        return "No response received from agent."
+
+    except Exception as e:
+        return f"Error processing message: {str(e)}"
+
 
 @cl.on_chat_start
 async def start():
@@ -194,31 +297,37 @@ async def start():
         content="🤖 Initializing Azure AI agent with MCP...",
         author="System"
     ).send()
-    
-    # Initialize the agent
-    success = await agent_handler.initialize()
-    
-    if success:
-        await cl.Message(
-            content="✅ Agent initialized successfully! You can now ask questions about your home automation system.",
-            author="System"
-        ).send()
-        
-        # Store agent information in user session
-        cl.user_session.set("agent_ready", True)
-        cl.user_session.set("agent_id", agent_handler.agent.id)
-        cl.user_session.set("thread_id", agent_handler.thread.id)
-        
-        await cl.Message(
-            content=f"📋 **Session Information:**\n- Agent ID: `{agent_handler.agent.id}`\n- Thread ID: `{agent_handler.thread.id}`\n- MCP Server: `{agent_handler.mcp_tool.server_label}`",
-            author="System"
-        ).send()
-    else:
+
+    try:
+        # Agent lookup and thread creation are independent round-trips; run
+        # them concurrently instead of back-to-back
+        agent, thread = await asyncio.gather(
+            _ensure_agent(),
+            AGENTS_CLIENT.threads.create(),
+        )
+    except Exception as e:
+        print(f"Error initializing session: {e}")
         await cl.Message(
             content="❌ Error initializing agent. Please check your environment variables configuration.",
             author="System"
         ).send()
         cl.user_session.set("agent_ready", False)
+        return
+
+    await cl.Message(
+        content="✅ Agent initialized successfully! You can now ask questions about your home automation system.",
+        author="System"
+    ).send()
+
+    # Store agent information in user session
+    cl.user_session.set("agent_ready", True)
+    cl.user_session.set("agent_id", agent.id)
+    cl.user_session.set("thread_id", thread.id)
+
+    await cl.Message(
+        content=f"📋 **Session Information:**\n- Agent ID: `{agent.id}`\n- Thread ID: `{thread.id}`\n- MCP Server: `{MCP_TOOL.server_label}`",
+        author="System"
+    ).send()
 
 @cl.on_message
 async def main(message: cl.Message):
@@ -230,28 +339,22 @@ async def main(message: cl.Message):
             author="System"
         ).send()
         return
-    
+
     # Show processing indicator
     async with cl.Step(name="Processing with Azure AI Agent + MCP") as step:
         step.output = "Sending message to agent..."
-        
+
         # Send message to agent and get response
-        response = await agent_handler.send_message(message.content)
-        
+        response = await send_message(message.content)
+
         step.output = f"Response received: {len(response)} characters"
-    
+
     # Send response to user
     await cl.Message(
         content=response,
         author="AI Assistant"
     ).send()
 
-@cl.on_chat_end
-async def end():
-    """Runs when chat session ends"""
-    agent_handler.cleanup()
-    print("Chat session ended, resources cleaned up.")
-
 if __name__ == "__main__":
     # To run directly with python (not recommended, use 'chainlit run mainchat.py')
     print("To run this application, use: chainlit run mainchat.py")